@@ -74,19 +74,22 @@ def convertBvhToHierarchy(bvh: BvhJoint) -> Joint:
         joint.setKeyframe(frame, Transform.fromPose(key), keep=None)
 
     # correct bvh keyframe data
+    restSpaceInverse = restPose.SpaceInverse
+    restRotation = restPose.Rotation
+    restRotationInverse = glm.inverse(restRotation)
     for frame, key in joint.Keyframes:
         # project offset into rest pose because it is given as overwrite and does not include the rest pose rotation.
-        key.Position = joint.RestPose.SpaceInverse * key.Position
+        key.Position = restSpaceInverse * key.Position
 
         # the rotation is already given as difference, but the multiplication order is switched.
-        key.Rotation = key.Rotation * joint.RestPose.Rotation
-        key.Rotation = (glm.inverse(joint.RestPose.Rotation) * key.Rotation)
+        key.Rotation = key.Rotation * restRotation
+        key.Rotation = (restRotationInverse * key.Rotation)
 
     for child in bvh.Children:
         # correct the rest pose, because its given without the parents rest pose rotation.
         childJoint = convertBvhToHierarchy(child)
-        childJoint.RestPose.Position = glm.inverse(joint.RestPose.Rotation) * childJoint.RestPose.Position
-        childJoint.RestPose.Rotation = glm.inverse(joint.RestPose.Rotation) * childJoint.RestPose.Rotation
+        childJoint.RestPose.Position = restRotationInverse * childJoint.RestPose.Position
+        childJoint.RestPose.Rotation = restRotationInverse * childJoint.RestPose.Rotation
         joint.attach(childJoint, keep=None)
 
     return joint
@@ -94,36 +97,47 @@ def convertBvhToHierarchy(bvh: BvhJoint) -> Joint:
 
 def convertHierarchyToBvh(joint: Joint, frames: int, worldSpace: Optional[Pose] = None) -> BvhJoint:
     """Converts a joint structure into a deseralized bvh structure."""
+    joints = joint._flatten()
+    parents = joint._ParentIdx.tolist()
+    spaces: list[Pose] = [None] * len(joints)
+    bvhJoints: list[BvhJoint] = [None] * len(joints)
+
+    # parents are listed before their children, so their world space is already known
+    for index, node in enumerate(joints):
+        parent = parents[index]
+        if parent >= 0:
+            space = spaces[parent].duplicate()
+        else:
+            space = Pose() if worldSpace is None else worldSpace
 
-    if worldSpace is None:
-        worldSpace = Pose()
-
-    bvh = BvhJoint(joint.Name)
-    bvh.Offset = worldSpace.Space * joint.RestPose.Position
-    bvh.EndSite = (worldSpace.Space * (0, 1, 0)) * glm.length(joint.RestPose.Position) * 0.3
-    bvh.Keyframes = [joint.getKeyframe(frame).toPose(worldSpace=False) for frame in range(frames)]
+        bvh = BvhJoint(node.Name)
+        bvh.Offset = space.Space * node.RestPose.Position
+        bvh.EndSite = (space.Space * (0, 1, 0)) * glm.length(node.RestPose.Position) * 0.3
+        keys = map(node._peekKeyframe, range(frames))
+        bvh.Keyframes = [Pose(key._Position, key._Rotation, key._Scale) for key in keys]
 
-    worldSpace.Rotation = worldSpace.Rotation * joint.RestPose.Rotation
-    worldSpace.Scale = worldSpace.Scale * joint.RestPose.Scale
+        space.Rotation = space.Rotation * node.RestPose.Rotation
+        space.Scale = space.Scale * node.RestPose.Scale
 
-    if 1e-02 < glm.l1Norm(sum([glm.abs(pose.Position) for pose in bvh.Keyframes])):
-        bvh.Channels.extend(['Xposition', 'Yposition', 'Zposition'])
+        if 1e-02 < glm.l1Norm(sum([glm.abs(pose.Position) for pose in bvh.Keyframes])):
+            bvh.Channels.extend(['Xposition', 'Yposition', 'Zposition'])
 
-    if 1e-02 < (sum([sum([abs(d) for d in (pose.Rotation - glm.quat()).to_list()]) for pose in bvh.Keyframes])):
-        bvh.Channels.extend(['Zrotation', 'Xrotation', 'Yrotation'])
+        if 1e-02 < (sum([sum([abs(d) for d in (pose.Rotation - glm.quat()).to_list()]) for pose in bvh.Keyframes])):
+            bvh.Channels.extend(['Zrotation', 'Xrotation', 'Yrotation'])
 
-    # convert data to bvh
-    for key in bvh.Keyframes:
-        key.Position = bvh.Offset + (worldSpace.Space * key.Position)
-        key.Rotation = worldSpace.Rotation * key.Rotation
-        key.Rotation = (key.Rotation * glm.inverse(worldSpace.Rotation))
+        # convert data to bvh
+        for key in bvh.Keyframes:
+            key.Position = bvh.Offset + (space.Space * key.Position)
+            key.Rotation = space.Rotation * key.Rotation
+            key.Rotation = (key.Rotation * glm.inverse(space.Rotation))
 
-    # add children
-    for child in joint.Children:
-        childBvh = convertHierarchyToBvh(child, frames, worldSpace.duplicate())
-        bvh.Children.append(childBvh)
+        # add to parent
+        spaces[index] = space
+        bvhJoints[index] = bvh
+        if parent >= 0:
+            bvhJoints[parent].Children.append(bvh)
 
-    return bvh
+    return bvhJoints[0]
 
 
 def readAsHierarchy(path: str, loadKeyFrames: bool = True) -> Joint:
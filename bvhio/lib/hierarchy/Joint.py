@@ -1,8 +1,136 @@
 import glm
 import bisect
+import numpy
+import operator
+from collections import deque
 from SpatialTransform import Transform, Pose
 
 
+# the inverse of a unit quaternion is its conjugate, which skips the division by the norm
+_qconj = glm.conjugate
+
+
+def _quatNlerp(a: glm.quat, b: glm.quat, weight: float) -> glm.quat:
+    """Interpolates linearly along the shortest path between two rotations and normalizes the result.
+    - Accurate for closely spaced keyframes, ``glm.slerp`` would keep a constant angular velocity for wide gaps."""
+    if glm.dot(a, b) < 0: b = -b
+    return glm.normalize(glm.lerp(a, b, weight))
+
+
+def _blendKeyframes(before: Pose, after: Pose, weight: float) -> tuple[glm.vec3, glm.quat, glm.vec3]:
+    """Interpolates the properties of two keyframes -> (position, rotation, scale)."""
+    return (
+        glm.lerp(before._Position, after._Position, weight),
+        _quatNlerp(before._Rotation, after._Rotation, weight),
+        glm.lerp(before._Scale, after._Scale, weight))
+
+
+def _quatMulArray(a: numpy.ndarray, b: numpy.ndarray) -> numpy.ndarray:
+    """Row wise ``a * b`` of a rotation with the shape (4,) and an array of rotations with the shape (N, 4)."""
+    aw, ax, ay, az = a
+    bw, bx, by, bz = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return numpy.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw), axis=1)
+
+
+def _sampleHierarchyKernel(
+        frame: int,
+        offsets: numpy.ndarray, counts: numpy.ndarray,
+        idx: numpy.ndarray, span: numpy.ndarray,
+        pos: numpy.ndarray, rot: numpy.ndarray, scl: numpy.ndarray,
+        outPos: numpy.ndarray, outRot: numpy.ndarray, outScl: numpy.ndarray) -> None:
+    """Compiled loop of ``Joint._sampleHierarchy()``, writes the properties of each joint into the out arrays."""
+    for joint in range(len(counts)):
+        count = counts[joint]
+        if count == 0:
+            outPos[joint, :] = 0
+            outRot[joint, :] = 0
+            outRot[joint, 0] = 1
+            outScl[joint, :] = 1
+            continue
+
+        first = offsets[joint]
+        last = first + count - 1
+        current = frame if frame >= 0 else max(0, idx[last] + 1 - frame)
+
+        # bisect within the keyframes of the joint
+        low, high = first, last + 1
+        while low < high:
+            middle = (low + high) // 2
+            if idx[middle] < current: low = middle + 1
+            else: high = middle
+
+        # matching keyframes and frames out of the keyframe range blend a key with itself
+        if low > last or idx[low] == current:
+            before = after = min(low, last)
+        elif low == first:
+            before = after = first
+        else:
+            before, after = low - 1, low
+        weight = (current - idx[before]) * span[before] if before != after else 0.0
+
+        for axis in range(3):
+            outPos[joint, axis] = pos[before, axis] * (1 - weight) + pos[after, axis] * weight
+            outScl[joint, axis] = scl[before, axis] * (1 - weight) + scl[after, axis] * weight
+
+        if before == after:
+            outRot[joint, :] = rot[before, :]
+        else:
+            dot = 0.0
+            for axis in range(4):
+                dot += rot[before, axis] * rot[after, axis]
+            sign = -1.0 if dot < 0 else 1.0
+
+            length = 0.0
+            for axis in range(4):
+                outRot[joint, axis] = rot[before, axis] * (1 - weight) + sign * rot[after, axis] * weight
+                length += outRot[joint, axis] * outRot[joint, axis]
+            outRot[joint, :] /= numpy.sqrt(length)
+
+
+# compiled sampling kernel, False if numba is not installed and None until it is needed first
+_compiledHierarchyKernel = None
+
+
+def _getHierarchyKernel():
+    """Returns ``_sampleHierarchyKernel()`` compiled with numba, or None if numba is not installed.
+    - numba is optional and only imported on the first call, so importing bvhio stays fast.
+    - The compiled kernel is cached on disk, so only the first run of a program compiles it."""
+    global _compiledHierarchyKernel
+    if _compiledHierarchyKernel is None:
+        try:
+            import numba
+            _compiledHierarchyKernel = numba.njit(_sampleHierarchyKernel, cache=True, fastmath=True)
+        except ImportError:
+            _compiledHierarchyKernel = False
+    return _compiledHierarchyKernel or None
+
+
+# joint count from which loadPose() samples the hierarchy at once instead of joint by joint.
+# only the compiled kernel is faster and only for larger hierarchies, without numba joints are always sampled one by one.
+_BATCH_SAMPLING_JOINTS = 64
+
+# number of interpolated keyframes each joint keeps for repeated requests of the same frames
+_POSE_CACHE_SIZE = 8
+
+# attributes of a pose that hold the keyframe properties
+_KEYFRAME_PROPERTIES = frozenset(('_Position', '_Rotation', '_Scale'))
+
+
+class _Keyframe(Transform):
+    """Transform for keyframes of a joint, which counts the changes of its properties at the joint to mark the keyframe arrays as outdated.
+    - Stored keyframes are handed out and may be modified in place at any time, so the joint cannot rely on being told."""
+    _Owner: "Joint" = None
+
+    def __setattr__(self, name: str, value) -> None:
+        object.__setattr__(self, name, value)
+        if name in _KEYFRAME_PROPERTIES and self._Owner is not None:
+            self._Owner._KF_version += 1
+
+
 class Joint(Transform):
     """Spatial definition of an linear space with position, rotation and scale.
     - Bone alignment is expected to be along the Y+ axis.
@@ -26,19 +154,38 @@ class Joint(Transform):
         return self._CurrentFrame
 
     @property
-    def Keyframes(self) -> list[tuple[int, Transform]]:
+    def Keyframes(self) -> tuple[tuple[int, Transform], ...]:
         """Animation data for the joint. A keyframe holds the change of local properties in relation to the rest pose, so that ``Pose = RestPose + Keyframe``.
     - The first element in the tuple is the frame id and the second element are the local keyframe properties.
-    - This is an ordered list by the frame id.
+    - This is an ordered tuple by the frame id.
+    - The tuple can not be modified, use the setter or methods like ``setKeyframe()`` to change the keyframes.
     - Negative frame ids should not exist."""
-        return self._Keyframes
+        if self._KeyframeTuple is None:
+            self._KeyframeTuple = tuple(zip(self._KeyframeIndex, self._KeyframeValues))
+        return self._KeyframeTuple
 
     @Keyframes.setter
     def Keyframes(self, value: list[tuple[int, Transform]]) -> None:
-        self._Keyframes = list(value)
-        self._KeyframeMap = {frame: key for frame, key in self._Keyframes}
+        # a frame id can only hold one keyframe, the last one given is kept
+        keyframes = sorted(dict(value).items(), key=lambda keyframe: keyframe[0])
+        for key in self._KeyframeValues:
+            if isinstance(key, _Keyframe) and key._Owner is self: key._Owner = None
+        self._KeyframeIndex = [frame for frame, key in keyframes]
+        self._KeyframeValues = [key for frame, key in keyframes]
+        self._KeyframeMap = dict(keyframes)
+
+        # changes of other transforms can not be noticed, their keyframe arrays are rebuilt whenever they are used.
+        # a keyframe reports to one joint only, so a joint that gives a keyframe away can not notice its changes anymore.
+        for key in self._KeyframeValues:
+            if not isinstance(key, _Keyframe): continue
+            if key._Owner is not None: key._Owner._KF_tracked = False
+            key._Owner = self
+        self._KF_tracked = self.__ownsKeyframes()
+        self._SegmentInvSpan = self.__getSegmentInvSpans(0, len(keyframes) - 1)
+        self._UniformStride = self.__getUniformStride()
+        self.__invalidateKeyframes()
         self.RestPose.clearChildren(keep=[None])
-        self.RestPose.attach(*[key for frame, key in value], keep=[None])
+        self.RestPose.attach(*self._KeyframeValues, keep=[None])
 
     @property
     def RestPose(self) -> Transform:
@@ -62,68 +209,304 @@ class Joint(Transform):
         self._Children: list["Joint"] = []
 
         self._RestPose: Transform = Transform(name='RestPose') if restPose is None else restPose
-        self._Keyframes: list[tuple[int, Transform]] = [] if keyFrames is None else keyFrames
-        self._KeyframeMap = {frame: key for frame, key in self._Keyframes}
+        self._KeyframeIndex: list[int] = []
+        self._KeyframeValues: list[Transform] = []
+        self._KeyframeMap: dict[int, Transform] = {}
+        self._KeyframeTuple: tuple[tuple[int, Transform], ...] = None
+        self._SegmentInvSpan: list[float] = []
+        self._UniformStride: int = 0
+        self._KeyCursor: int = 0
+        self._LastQueryFrame: int = -1
+        self._ScratchPose: Pose = Pose()
+        self._PoseCache: dict[int, tuple[Pose, tuple]] = {}
+        self._PoseCacheOrder: deque[int] = deque(maxlen=_POSE_CACHE_SIZE)
+        self._KF_idx: numpy.ndarray = None
+        self._KF_version: int = 0
+        self._KF_synced: int = -1
+        self._KF_loaded: int = -1
+        self._KF_tracked: bool = True
+        self._KF_span: numpy.ndarray = None
+        self._KF_raw: numpy.ndarray = None
+        self._KF_pos: numpy.ndarray = None
+        self._KF_rot: numpy.ndarray = None
+        self._KF_scl: numpy.ndarray = None
+        self._KF_all: tuple[numpy.ndarray, ...] = None
+        self._KF_allSources: list[numpy.ndarray] = None
+        self._RestSpace: glm.mat4 = None
+        self._RestSpaceInverse: glm.mat4 = None
+        self._FlatCache: list["Joint"] = None
+        self._RangeCache: tuple[int, int] = None
+        self._ParentIdx: numpy.ndarray = None
         self._CurrentFrame = -1
 
-    def __findFrameIndex(self, frame: int):
-        if not self.Keyframes:
-            return 0
+        if keyFrames is not None:
+            self.Keyframes = keyFrames
 
-        if frame > self.Keyframes[-1][0]:
-            return len(self.Keyframes)
-               
-        return bisect.bisect_left([key[0] for key in self.Keyframes], frame)
+    def __findFrameIndex(self, frame: int):
+        # playback reads frames in ascending order, so the search continues from the previous result.
+        # the cursor is always the bisect index of the last queried frame.
+        keys = self._KeyframeIndex
+        if self._UniformStride:
+            # evenly spaced keyframes are found without searching
+            return min(max(0, int(-((keys[0] - frame) // self._UniformStride))), len(keys))
+
+        index = self._KeyCursor
+        if frame < self._LastQueryFrame:
+            index = bisect.bisect_left(keys, frame)
+        elif index < len(keys) and keys[index] < frame:
+            index += 1
+            if index < len(keys) and keys[index] < frame:
+                index = bisect.bisect_left(keys, frame, index + 1)
+
+        self._KeyCursor = index
+        self._LastQueryFrame = frame
+        return index
+
+    def __invalidateKeyframes(self) -> None:
+        # frame ids have changed, this affects the keyframe range of all joints above
+        self._KeyframeTuple = None
+        self._KeyCursor = 0
+        self._LastQueryFrame = -1
+        self.__invalidateKeyframeValues()
+
+        joint = self
+        while joint is not None:
+            joint._RangeCache = None
+            joint = joint._Parent
+
+    def __invalidateKeyframeValues(self) -> None:
+        # keyframe properties may have changed, stored keyframes handed out can be modified in place
+        self._KF_version += 1
+        self._PoseCache.clear()
+        self._PoseCacheOrder.clear()
+
+    def __getRestSpaceInverse(self) -> glm.mat4:
+        # the rest pose rebuilds its space only after changes, the inverse is renewed along with it
+        space = self._RestPose.Space
+        if self._RestSpace is not self._RestPose._Space:
+            self._RestSpace = self._RestPose._Space
+            self._RestSpaceInverse = glm.inverse(space)
+        return self._RestSpaceInverse
+
+    def __getSegmentInvSpans(self, start: int, stop: int) -> list[float]:
+        # inverse frame distance of the segments between the keyframes, the segment i starts at keyframe i
+        keys = self._KeyframeIndex
+        return [1.0 / (keys[i + 1] - keys[i]) for i in range(start, stop)]
+
+    def __getUniformStride(self) -> int:
+        # frame distance between the keyframes if they are evenly spaced, otherwise 0
+        keys = self._KeyframeIndex
+        if len(keys) < 2: return 0
+        stride = keys[1] - keys[0]
+        return stride if all(keys[i + 1] - keys[i] == stride for i in range(1, len(keys) - 1)) else 0
 
     def __insertKeyframe(self, frame: int, key: Transform) -> None:
-        bisect.insort(self.Keyframes, (frame, key))
+        keys = self._KeyframeIndex
+        if len(keys) == 0 or keys[-1] < frame:
+            # keyframes are mostly added in ascending order, appending them needs no search or shifting
+            if len(keys) > 0:
+                distance = frame - keys[-1]
+                self._SegmentInvSpan.append(1.0 / distance)
+                self._UniformStride = distance if len(keys) == 1 or distance == self._UniformStride else 0
+            keys.append(frame)
+            self._KeyframeValues.append(key)
+            self._KeyframeMap[frame] = key
+            self.__invalidateKeyframes()
+            return
+
+        index = bisect.bisect_left(keys, frame)
+        keys.insert(index, frame)
+        self._KeyframeValues.insert(index, key)
         self._KeyframeMap[frame] = key
 
+        # the segment the keyframe falls into is split into two
+        start = max(0, index - 1)
+        self._SegmentInvSpan[start:index] = self.__getSegmentInvSpans(start, index + 1)
+        self._UniformStride = self.__getUniformStride()
+        self.__invalidateKeyframes()
+
+    def __removeKeyframe(self, index: int) -> Transform:
+        del self._KeyframeMap[self._KeyframeIndex.pop(index)]
+        key = self._KeyframeValues.pop(index)
+        if isinstance(key, _Keyframe) and key._Owner is self: key._Owner = None
+        if not self._KF_tracked: self._KF_tracked = self.__ownsKeyframes()
+
+        # the two segments around the keyframe are merged into one
+        start = max(0, index - 1)
+        self._SegmentInvSpan[start:index + 1] = self.__getSegmentInvSpans(start, min(index, len(self._KeyframeIndex) - 1))
+        self._UniformStride = self.__getUniformStride()
+        self.__invalidateKeyframes()
+        return key
+
+    def __ownsKeyframes(self) -> bool:
+        # only keyframes that report their changes to this joint allow to keep the keyframe arrays
+        return all(isinstance(key, _Keyframe) and key._Owner is self for key in self._KeyframeValues)
+
     def getKeyframe(self, frame: int) -> Transform:
         """Returns the pose at the given frame id.
         - If the frame number is negative, it will look for the n-th frame from the end.
         - If there are no keyframes, the joint propetries will not change.
         - If the frame id is out of the keyframe length, the nearest keyframe propetires are used.
         - If the frame id is between two keyframes, pose properties are linearly interpolated."""
-        if len(self.Keyframes) == 0:
+        if len(self._KeyframeIndex) == 0:
             key = Transform(name=f'Key {frame} (placeholder)')
             self.RestPose.duplicate(recursive=False).attach(key, keep=None)
             return key
 
-        if frame < 0: frame = max(0, self.getKeyframeRange(includeChildren=False)[1] + 1 - frame)
+        before, after, weight = self.__resolveKeyframe(frame)
+        if before is after:
+            return before
+
+        # frame is in between two keyframes, interpolate
+        pose = self.__getInterpolatedPose(frame, before, after, weight)
+        key = Transform(name=f'Key {frame} (interpolated)', position=pose._Position, rotation=pose._Rotation, scale=pose._Scale)
+        self.RestPose.duplicate(recursive=False).attach(key, keep=None)
+        return key
 
-        existingFrame = self._KeyframeMap.get(frame)
+    def __resolveKeyframe(self, frame: int) -> tuple[Transform, Transform, float]:
+        # the stored keyframes around the frame id and the weight between them -> (before, after, weight).
+        # matching keyframes and frames out of the keyframe range return the same keyframe twice, there must be at least one keyframe.
+        keys = self._KeyframeIndex
+        if frame < 0: frame = max(0, keys[-1] + 1 - frame)
+
+        key = self._KeyframeMap.get(frame)
+        if key is not None:
+            # frame matches a keyframe
+            return (key, key, 0.0)
 
-        if existingFrame:
-            return existingFrame
-        
-        # pose definition
         index = self.__findFrameIndex(frame)
-        if index == len(self.Keyframes):
-            # index is bigger than last frame, take last key
-            return self.Keyframes[-1][1]
-        elif self.Keyframes[index][0] == frame:
-            # index matches a keyframe
-            return self.Keyframes[index][1]
-        else:
-            if index == 0:
-                # index is smaller than first frame, take first key
-                return self.Keyframes[-1][1]
-            else:
-                # index is in between two keyframes, interpolate
-                before = self.Keyframes[index - 1]
-                after = self.Keyframes[index]
-                weight = (before[0] + frame) / after[0]
-
-                restPoseCopy = self.RestPose.duplicate(recursive=False).attach(
-                    Transform(
-                        name=f'Key {frame} (interpolated)',
-                        position=glm.lerp(before[1].Position, after[1].Position, weight),
-                        rotation=glm.lerp(before[1].Rotation, after[1].Rotation, weight),
-                        scale=glm.lerp(before[1].Scale, after[1].Scale, weight)
-                    ), keep=None
-                )
-                return restPoseCopy.Children[0]
+        if index == len(keys):
+            # frame is after the last keyframe, take the last key
+            key = self._KeyframeValues[-1]
+            return (key, key, 0.0)
+        elif index == 0:
+            # frame is before the first keyframe, take the first key
+            key = self._KeyframeValues[0]
+            return (key, key, 0.0)
+
+        weight = (frame - keys[index - 1]) * self._SegmentInvSpan[index - 1]
+        return (self._KeyframeValues[index - 1], self._KeyframeValues[index], weight)
+
+    def __getInterpolatedPose(self, frame: int, before: Transform, after: Transform, weight: float) -> Pose:
+        # keyframes can be modified in place after they were handed out, so a cached pose is only used
+        # while the two keyframes around the frame still hold the properties it was interpolated from.
+        sources = (before._Position, before._Rotation, before._Scale, after._Position, after._Rotation, after._Scale)
+
+        # the least recently requested pose is dropped when the cache is full
+        order = self._PoseCacheOrder
+        cached = self._PoseCache.get(frame)
+        if cached is not None and all(map(operator.is_, cached[1], sources)):
+            order.remove(frame)
+            order.append(frame)
+            return cached[0]
+
+        position, rotation, scale = _blendKeyframes(before, after, weight)
+        pose = Pose(position=position, rotation=rotation, scale=scale)
+        if cached is not None: order.remove(frame)
+        elif len(order) == order.maxlen: del self._PoseCache[order[0]]
+        self._PoseCache[frame] = (pose, sources)
+        order.append(frame)
+        return pose
+
+    def _flatten(self) -> list["Joint"]:
+        """Returns this joint and all joints below it in depth first order, so parents are always listed before their children.
+        - The list is cached until the hierarchy below this joint changes.
+        - ``_ParentIdx`` holds the list index of the parent for each joint, or -1 for this joint."""
+        if self._FlatCache is None:
+            flat, parents = [], []
+            stack = [(self, -1)]
+            while stack:
+                joint, parent = stack.pop()
+                flat.append(joint)
+                parents.append(parent)
+                stack.extend((child, len(flat) - 1) for child in reversed(joint._Children))
+            self._FlatCache = flat
+            self._ParentIdx = numpy.array(parents, dtype=numpy.int32)
+        return self._FlatCache
+
+    def __invalidateHierarchy(self) -> None:
+        joint = self
+        while joint is not None:
+            joint._FlatCache = None
+            joint._RangeCache = None
+            joint = joint._Parent
+
+    def _getKeyframeArrays(self) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Returns the keyframes as contiguous arrays -> (frame ids, inverse segment spans, positions, rotations, scales).
+        - Rotations are stored as (w, x, y, z).
+        - The span array has a trailing zero, so it has one entry per keyframe.
+        - Positions, rotations and scales are column views of one buffer with a row of 10 values per keyframe.
+        - The arrays are cached until the keyframes change, keyframes modified in place are noticed too."""
+        if self._KF_synced != self._KF_version or not self._KF_tracked:
+            values = self._KeyframeValues
+            self._KF_synced = self._KF_version
+            self._KF_idx = numpy.array(self._KeyframeIndex, dtype=numpy.int32)
+            self._KF_span = numpy.array(self._SegmentInvSpan + [0.0])[:len(values)]
+            self.__setKeyframeBuffer(numpy.array([(*key._Position, *key._Rotation, *key._Scale) for key in values], dtype=numpy.float32).reshape(-1, 10))
+        return (self._KF_idx, self._KF_span, self._KF_pos, self._KF_rot, self._KF_scl)
+
+    def __setKeyframeBuffer(self, raw: numpy.ndarray) -> None:
+        self._KF_raw = raw
+        self._KF_pos, self._KF_rot, self._KF_scl = raw[:, 0:3], raw[:, 3:7], raw[:, 7:10]
+
+    def _getHierarchyArrays(self) -> tuple[numpy.ndarray, ...]:
+        """Returns the keyframe arrays of all joints from ``_flatten()`` concatenated, like a ragged array.
+        - Layout -> (row offsets, row counts, frame ids, inverse segment spans, positions, rotations, scales).
+        - The arrays are cached until the hierarchy or any of the keyframes change."""
+        sources = [joint._getKeyframeArrays() for joint in self._flatten()]
+        cache = self._KF_all
+        if cache is None or len(cache[1]) != len(sources) or any(source[2] is not pos for source, pos in zip(sources, self._KF_allSources)):
+            counts = numpy.array([len(source[0]) for source in sources], dtype=numpy.int64)
+            offsets = numpy.cumsum(counts) - counts
+            raw = numpy.concatenate([joint._KF_raw for joint in self._flatten()])
+
+            # the joints keep views of the concatenated rows, so rows updated in place are seen by both
+            for joint, offset, count in zip(self._flatten(), offsets.tolist(), counts.tolist()):
+                joint.__setKeyframeBuffer(raw[offset:offset + count])
+            cache = (
+                offsets,
+                counts,
+                numpy.concatenate([source[0] for source in sources]).astype(numpy.int64),
+                numpy.concatenate([source[1] for source in sources]),
+                raw[:, 0:3],
+                raw[:, 3:7],
+                raw[:, 7:10])
+            self._KF_all = cache
+            self._KF_allSources = [joint._KF_pos for joint in self._flatten()]
+        return cache
+
+    def _sampleHierarchy(self, frame: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """Resolves the local keyframe properties at the given frame id for all joints from ``_flatten()`` at once, like ``getKeyframe()`` does for a single joint.
+
+        Returns the arrays -> (positions, rotations, scales), one row per joint."""
+        kernel = _getHierarchyKernel()
+        if kernel is None:
+            # without numba the joints are sampled one by one
+            keys = [joint._peekKeyframe(frame) for joint in self._flatten()]
+            return tuple(numpy.array([tuple(getattr(key, name)) for key in keys]) for name in ('_Position', '_Rotation', '_Scale'))
+
+        offsets, counts, idx, span, pos, rot, scl = self._getHierarchyArrays()
+        positions, rotations, scales = (numpy.empty((len(counts), size)) for size in (3, 4, 3))
+        kernel(frame, offsets, counts, idx, span, pos, rot, scl, positions, rotations, scales)
+        return (positions, rotations, scales)
+
+    def _peekKeyframe(self, frame: int) -> Pose:
+        """Returns the local keyframe properties at the given frame id, like ``getKeyframe()`` resolves them, without copying them.
+        - Stored keyframes are returned as they are, interpolated keyframes share the scratch pose of the joint.
+        - If there are no keyframes, the reset scratch pose is returned.
+        - The returned pose must only be read and is only valid until the next call."""
+        if len(self._KeyframeIndex) == 0:
+            self._ScratchPose.reset()
+            return self._ScratchPose
+
+        before, after, weight = self.__resolveKeyframe(frame)
+        if before is after:
+            return before
+
+        # frame is in between two keyframes, interpolate
+        out = self._ScratchPose
+        out.Position, out.Rotation, out.Scale = _blendKeyframes(before, after, weight)
+        return out
 
     def setKeyframe(self, frame: int, pose: Transform, keep: list[str] = ['position', 'rotation', 'scale']) -> "Joint":
         """Inserts the given pose to the the keyframes.
@@ -133,20 +516,31 @@ class Joint(Transform):
         if frame < 0: frame = max(0, self.getKeyframeRange(includeChildren=False)[1] + 1 - frame)
         index = self.__findFrameIndex(frame)
 
-        if index == len(self.Keyframes) or self.Keyframes[index][0] != frame:
-            newKey = Transform(name=f'Key {frame}', position=pose.Position, rotation=pose.Rotation, scale=pose.Scale)
-            self.__insertKeyframe(frame, newKey)
-            self.RestPose.attach(newKey, keep=keep)
-        else:
-            if 'position' in keep: self.Keyframes[index][1].PositionWorld = pose.Position
-            else: self.Keyframes[index][1].Position = pose.Position
-
-            if 'rotation' in keep: self.Keyframes[index][1].RotationWorld = pose.Rotation
-            else: self.Keyframes[index][1].Rotation = pose.Rotation
-
-            if 'scale' in keep: self.Keyframes[index][1].ScaleWorld = pose.Scale
-            else: self.Keyframes[index][1].Scale = pose.Scale
+        rest = self._RestPose
+        if index == len(self._KeyframeIndex) or self._KeyframeIndex[index] != frame:
+            key = _Keyframe(name=f'Key {frame}')
+            key._Owner = self
+            self.__insertKeyframe(frame, key)
 
+            # the new key has no parent yet, so attaching skips the lookup in the children of the rest pose
+            rest._Children.append(key)
+            key._Parent = rest
+            synced = False
+        else:
+            key = self._KeyframeValues[index]
+            synced = self._KF_tracked and self._KF_synced == self._KF_version
+
+        # kept properties are given in world space, the rest pose is the parent of the keyframes.
+        # the rest pose has no parent, so all properties are converted with its local space.
+        keep = keep or ()
+        key.Position = self.__getRestSpaceInverse() * pose.Position if 'position' in keep else pose.Position
+        key.Rotation = _qconj(rest._Rotation) * pose.Rotation if 'rotation' in keep else pose.Rotation
+        key.Scale = (1.0 / rest._Scale) * pose.Scale if 'scale' in keep else pose.Scale
+
+        # an overwritten keyframe only changes its own row of the keyframe arrays
+        if synced:
+            self._KF_raw[index] = (*key._Position, *key._Rotation, *key._Scale)
+            self._KF_synced = self._KF_version
         return self
 
     def removeKeyframe(self, frame: int, recursive: bool = False) -> "Joint":
@@ -156,12 +550,12 @@ class Joint(Transform):
         Returns itself."""
         index = self.__findFrameIndex(frame)
 
-        if index != len(self.Keyframes) and self.Keyframes[index][0] == frame:
-            self.Keyframes.pop(index)[1].clearParent(keep=None)
+        if index != len(self._KeyframeIndex) and self._KeyframeIndex[index] == frame:
+            self.__removeKeyframe(index).clearParent(keep=None)
 
         if recursive:
-            for child in self.Children:
-                child.removeKeyframe(frame=frame, recursive=True)
+            for child in self._flatten()[1:]:
+                child.removeKeyframe(frame=frame, recursive=False)
 
         return self
 
@@ -170,15 +564,12 @@ class Joint(Transform):
         - This is the animation data without rest pose.
 
         Returns itself."""
-        key = self.getKeyframe(frame)
-
-        if 'position' in use: self.Position = key.Position
-        if 'rotation' in use: self.Rotation = key.Rotation
-        if 'scale' in use: self.Scale = key.Scale
+        for joint in (self._flatten() if recursive else (self,)):
+            key = joint._peekKeyframe(frame)
 
-        if recursive:
-            for child in self.Children:
-                child.loadKeyframe(frame=frame, recursive=True, use=use)
+            if 'position' in use: joint.Position = key._Position
+            if 'rotation' in use: joint.Rotation = key._Rotation
+            if 'scale' in use: joint.Scale = key._Scale
 
         return self
 
@@ -187,15 +578,11 @@ class Joint(Transform):
         - If recursive is True -> Child joints do also load their rest pose.
 
         Returns itself."""
-        # self alignment
-        if 'position' in use: self.Position = self.RestPose.Position
-        if 'rotation' in use: self.Rotation = self.RestPose.Rotation
-        if 'scale' in use: self.Scale = self.RestPose.Scale
-
-        # recursion
-        if recursive:
-            for child in self.Children:
-                child.loadRestPose(recursive=True, use=use)
+        for joint in (self._flatten() if recursive else (self,)):
+            rest = joint._RestPose
+            if 'position' in use: joint.Position = rest._Position
+            if 'rotation' in use: joint.Rotation = rest._Rotation
+            if 'scale' in use: joint.Scale = rest._Scale
 
         return self
 
@@ -208,10 +595,26 @@ class Joint(Transform):
         Returns itself."""
         # remove change in rest pose from keyframes
         if keep:
-            for frame, key in self.Keyframes:
-                if 'position' in keep: key.Position = self.SpaceInverse * key.PositionWorld
-                if 'rotation' in keep: key.Rotation = glm.inverse(self.Rotation) * key.RotationWorld
-                if 'scale' in keep: key.Scale = (key.Scale / self.ScaleWorld)
+            # the change from the old to the new rest pose is the same for all keyframes
+            rest = self._RestPose
+            space = self.SpaceInverse * rest.Space
+            rotation = _qconj(self._Rotation) * rest._Rotation
+            scale = rest._Scale / self._Scale
+            keepPosition, keepRotation, keepScale = 'position' in keep, 'rotation' in keep, 'scale' in keep
+            synced = self._KF_tracked and self._KF_synced == self._KF_version
+            for key in self._KeyframeValues:
+                if keepPosition: key.Position = space * key._Position
+                if keepRotation: key.Rotation = rotation * key._Rotation
+                if keepScale: key.Scale = scale * key._Scale
+
+            # keyframe arrays in sync get the same change for all rows at once instead of being rebuilt
+            if synced:
+                raw = self._KF_raw
+                matrix = numpy.array(space, dtype=numpy.float32)
+                if keepPosition: raw[:, 0:3] = raw[:, 0:3] @ matrix[:3, :3].T + matrix[:3, 3]
+                if keepRotation: raw[:, 3:7] = _quatMulArray(numpy.array(rotation, dtype=numpy.float32), raw[:, 3:7])
+                if keepScale: raw[:, 7:10] *= numpy.array(scale, dtype=numpy.float32)
+                self._KF_synced = self._KF_version
 
         # write rest pose
         self.RestPose.Position = self.Position
@@ -220,8 +623,8 @@ class Joint(Transform):
 
         # recursion
         if recursive:
-            for child in self.Children:
-                child.writeRestPose(recursive=True, keep=keep)
+            for child in self._flatten()[1:]:
+                child.writeRestPose(recursive=False, keep=keep)
 
         return self
 
@@ -234,21 +637,53 @@ class Joint(Transform):
         - If recursive is True -> Child joints do also load their pose.
 
         Returns itself."""
-        # get animation data
-        key = self.getKeyframe(frame)
+        # small hierarchies are sampled joint by joint
+        joints = self._flatten() if recursive else (self,)
+        if len(joints) < _BATCH_SAMPLING_JOINTS or _getHierarchyKernel() is None or not self.__canSampleHierarchy(joints):
+            for joint in joints:
+                joint._loadPoseFast(frame, use)
+            return self
+
+        # large hierarchies are sampled at once
+        keys = zip(*(array.tolist() for array in self._sampleHierarchy(frame)))
+        usePosition, useRotation, useScale = 'position' in use, 'rotation' in use, 'scale' in use
+        vec3, quat = glm.vec3, glm.quat
+        for joint, (position, rotation, scale) in zip(joints, keys):
+            # set animation pose, world space includes the transform from the rest pose
+            rest = joint._RestPose
+            joint._CurrentFrame = frame
+            if usePosition: joint.Position = rest.Space * vec3(position)
+            if useRotation: joint.Rotation = rest._Rotation * quat(rotation)
+            if useScale: joint.Scale = rest._Scale * vec3(scale)
 
-        # set animation pose, world space includes the transform from the rest pose
+        return self
+
+    def __canSampleHierarchy(self, joints: list["Joint"]) -> bool:
+        # keyframes that are added between two loads, like with writePose(), would rebuild the arrays on every frame.
+        # outdated arrays are only rebuilt once the keyframes did not change since the previous load.
+        if all(joint._KF_synced == joint._KF_version and joint._KF_tracked for joint in joints): return True
+        if not all(joint._KF_tracked for joint in joints): return False
+        version = sum(joint._KF_version for joint in joints)
+        unchanged, self._KF_loaded = version == self._KF_loaded, version
+        return unchanged
+
+    def _loadPoseFast(self, frame: int, use: list[str]) -> None:
+        # loadPose() of this joint only, the keyframe is composed with the rest pose without an intermediate pose
         self._CurrentFrame = frame
-        if 'position' in use: self.Position = key.PositionWorld
-        if 'rotation' in use: self.Rotation = key.RotationWorld
-        if 'scale' in use: self.Scale = key.ScaleWorld
+        if len(self._KeyframeIndex) == 0:
+            key = self._peekKeyframe(frame)
+            position, rotation, scale = key._Position, key._Rotation, key._Scale
+        else:
+            before, after, weight = self.__resolveKeyframe(frame)
+            if before is after:
+                position, rotation, scale = before._Position, before._Rotation, before._Scale
+            else:
+                position, rotation, scale = _blendKeyframes(before, after, weight)
 
-        # may do it recursively
-        if recursive:
-            for child in self.Children:
-                child.loadPose(frame, recursive=True, use=use)
-
-        return self
+        rest = self._RestPose
+        if 'position' in use: self.Position = rest.Space * position
+        if 'rotation' in use: self.Rotation = rest._Rotation * rotation
+        if 'scale' in use: self.Scale = rest._Scale * scale
 
     def writePose(self, frameId: int, recursive: bool = True) -> "Joint":
         """Sets joint properties as animation pose for the given frame id.
@@ -263,25 +698,29 @@ class Joint(Transform):
 
         # recursion
         if recursive:
-            for child in self.Children:
-                child.writePose(frameId, recursive=True)
+            for child in self._flatten()[1:]:
+                child.writePose(frameId, recursive=False)
 
         return self
 
     def getKeyframeRange(self, includeChildren: bool = True) -> tuple[int, int]:
         """Returns the earliest and latest frame id of the animation.
         - If there are no keyframes, `(0, 0)` is returned.
-        - If includeChildren is True -> The range considers the earliest and latest frames from its children too.
+        - If includeChildren is True -> The range considers the earliest and latest frames from all joints below too.
         The tuple layout is -> [FirstFrameId, LastFrameId]"""
-        if len(self.Keyframes) == 0: return (0, 0)
-        range = (self.Keyframes[0][0], self.Keyframes[-1][0])
-
-        if includeChildren:
-            for child in self.Children:
-                childRange = child.getKeyframeRange(includeChildren=True)
-                range = (min(range[0], childRange[0]), max(range[1], childRange[1]))
-
-        return range
+        if not includeChildren:
+            keys = self._KeyframeIndex
+            return (keys[0], keys[-1]) if len(keys) > 0 else (0, 0)
+
+        # the range of the subtree is kept until keyframes or joints below change
+        if self._RangeCache is None:
+            range = None
+            for joint in self._flatten():
+                keys = joint._KeyframeIndex
+                if len(keys) == 0: continue
+                range = (keys[0], keys[-1]) if range is None else (min(range[0], keys[0]), max(range[1], keys[-1]))
+            self._RangeCache = (0, 0) if range is None else range
+        return self._RangeCache
 
     def roll(self, degrees: float, recursive: bool = False) -> "Joint":
         """Rotates the joint along its local Y axis and updates the children so there is no spatial change.
@@ -290,7 +729,7 @@ class Joint(Transform):
         Returns itself.
         """
         change = glm.angleAxis(glm.radians(degrees), (0, 1, 0))
-        changeInverse = glm.inverse(change)
+        changeInverse = _qconj(change)
 
         self.Rotation = self.Rotation * change
         for child in self.Children:
@@ -303,10 +742,14 @@ class Joint(Transform):
         return self
 
     def attach(self, *nodes: "Joint", keep: list[str] = ['position', 'rotation', 'scale']) -> "Joint":
-        return super().attach(*nodes, keep=keep)
+        super().attach(*nodes, keep=keep)
+        self.__invalidateHierarchy()
+        return self
 
     def detach(self, *nodes: "Joint", keep: list[str] = ['position', 'rotation', 'scale']) -> "Joint":
-        return super().detach(*nodes, keep=keep)
+        super().detach(*nodes, keep=keep)
+        self.__invalidateHierarchy()
+        return self
 
     def clearParent(self, keep: list[str] = ['position', 'rotation', 'scale']) -> "Joint":
         return super().clearParent(keep=keep)
@@ -329,6 +772,7 @@ class Joint(Transform):
         """
         change, changeInverse = self.RestPose._applyPositionGetChanges(position)
         self.RestPose.applyPosition(position, recursive=False)
+        self.__invalidateKeyframeValues()
 
         for child in self.Children:
             child.RestPose._applyPositionChangeInverse(changeInverse)
@@ -351,6 +795,7 @@ class Joint(Transform):
         """
         change, changeInverse = self.RestPose._applyRotationGetChanges(rotation)
         self.RestPose.applyRotation(rotation, recursive=False, bake=bakeKeyframes)
+        self.__invalidateKeyframeValues()
 
         for child in self.Children:
             child.RestPose._applyRotationChangeInverse(changeInverse, bake=bake)
@@ -373,6 +818,7 @@ class Joint(Transform):
         """
         change, changeInverse = self.RestPose._applyScaleGetChanges(scale)
         self.RestPose.applyScale(scale, recursive=False, bake=bakeKeyframes)
+        self.__invalidateKeyframeValues()
 
         for child in self.Children:
             child.RestPose._applyScaleChangeInverse(changeInverse, bake=bake)
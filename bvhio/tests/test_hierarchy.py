@@ -1,6 +1,7 @@
 import unittest
 import bvhio
 import glm
+import numpy
 from utils import *
 
 class Reading(unittest.TestCase):
@@ -194,6 +195,24 @@ class Methods(unittest.TestCase):
             self.assertGreater(1e-04, deviationQuaternion(animPose[i][1], j.RotationWorld))
             self.assertGreater(1e-04, deviationScale(animPose[i][2], j.ScaleWorld))
 
+    def test_write_changed_RestPose(self):
+        instance = bvhio.readAsHierarchy('bvhio/tests/example.bvh')
+        instance.loadPose(0, recursive=True)
+        animPose = [(joint.PositionWorld, joint.RotationWorld, joint.ScaleWorld) for joint, _ , _ in instance.layout()]
+
+        # a different rest pose must not change the animation
+        instance.loadRestPose(recursive=True)
+        for joint, _, _ in instance.layout():
+            joint.Position += glm.vec3(1, 2, 3)
+            joint.Rotation = glm.angleAxis(glm.radians(30), (0, 1, 0)) * joint.Rotation
+            joint.Scale = glm.vec3(2)
+        instance.writeRestPose(recursive=True, keep=['position', 'rotation', 'scale'])
+        instance.loadPose(0, recursive=True)
+        for j, i, d in instance.layout():
+            self.assertGreater(1e-04, deviationPosition(animPose[i][0], j.PositionWorld))
+            self.assertGreater(1e-04, deviationQuaternion(animPose[i][1], j.RotationWorld))
+            self.assertGreater(1e-04, deviationScale(animPose[i][2], j.ScaleWorld))
+
     def test_write_read_Pose(self):
         instance = bvhio.readAsHierarchy('bvhio/tests/example.bvh')
         instance.loadRestPose(recursive=True)
@@ -228,3 +247,191 @@ class Methods(unittest.TestCase):
                 self.assertGreater(1e-04, deviationScale(childPose[i][2], child.ScaleWorld))
 
         self.assertTrue(True)
+
+    def test_KeyframeRange_changes(self):
+        root, child, leaf = bvhio.Joint('Root'), bvhio.Joint('Child'), bvhio.Joint('Leaf')
+        root.attach(child.attach(leaf))
+        leaf.setKeyframe(5, bvhio.Transform(), keep=None)
+        self.assertEqual(root.getKeyframeRange(), (5, 5))
+
+        # the range of the joints above follows changes of keyframes and joints
+        leaf.setKeyframe(50, bvhio.Transform(), keep=None)
+        self.assertEqual(root.getKeyframeRange(), (5, 50))
+        leaf.removeKeyframe(50)
+        self.assertEqual(root.getKeyframeRange(), (5, 5))
+        child.detach(leaf)
+        self.assertEqual(root.getKeyframeRange(), (0, 0))
+
+    def test_interpolation(self):
+        joint = bvhio.Joint('Joint')
+        joint.setKeyframe(10, bvhio.Transform(position=(0, 0, 0), scale=(1, 1, 1)), keep=None)
+        joint.setKeyframe(20, bvhio.Transform(position=(10, 0, 0), scale=(2, 2, 2)), keep=None)
+
+        for frame in range(10, 21):
+            key = joint.getKeyframe(frame)
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(frame - 10, 0, 0), key.Position))
+            self.assertGreater(1e-05, deviationScale(glm.vec3(1 + (frame - 10) / 10), key.Scale))
+
+    def test_interpolation_outside(self):
+        root = bvhio.Joint('Root').attach(*[bvhio.Joint(f'Joint {i}') for i in range(3)])
+        for joint in root.layout():
+            joint[0].setKeyframe(10, bvhio.Transform(position=(10, 0, 0), scale=(1, 1, 1)), keep=None)
+            joint[0].setKeyframe(20, bvhio.Transform(position=(20, 0, 0), scale=(2, 2, 2)), keep=None)
+
+        # frames before the first keyframe take the first key, frames after the last take the last key
+        for frame, expected in ((0, 10), (5, 10), (25, 20)):
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), root.getKeyframe(frame).Position))
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), glm.vec3(root._sampleHierarchy(frame)[0][0])))
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), root.loadKeyframe(frame, recursive=False).Position))
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), root.loadPose(frame, recursive=False).Position))
+            for joint, _, _ in root.loadPose(frame, recursive=True).layout():
+                self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), joint.Position))
+
+    def test_interpolation_rotation(self):
+        joint = bvhio.Joint('Joint')
+        joint.setKeyframe(0, bvhio.Transform(rotation=glm.angleAxis(glm.radians(10), (0, 1, 0))), keep=None)
+        joint.setKeyframe(10, bvhio.Transform(rotation=-glm.angleAxis(glm.radians(50), (0, 1, 0))), keep=None)
+
+        # the keyframes are on opposite hemispheres, but the interpolation must take the short way
+        for frame in range(0, 11):
+            rotation = joint.getKeyframe(frame).Rotation
+            direction = rotation * glm.vec3(1, 0, 0)
+            self.assertGreater(1e-05, abs(1 - glm.length(rotation)))
+            self.assertLessEqual(10 - 1e-03, glm.degrees(glm.atan(-direction.z, direction.x)))
+            self.assertGreaterEqual(50 + 1e-03, glm.degrees(glm.atan(-direction.z, direction.x)))
+
+    def test_interpolation_cache(self):
+        joint = bvhio.Joint('Joint')
+        joint.setKeyframe(0, bvhio.Transform(position=(0, 0, 0)), keep=None)
+        joint.setKeyframe(10, bvhio.Transform(position=(10, 0, 0)), keep=None)
+
+        # returned keyframes are copies and changing keyframes invalidates the cache
+        joint.getKeyframe(5).Position = (100, 0, 0)
+        self.assertGreater(1e-05, deviationPosition(glm.vec3(5, 0, 0), joint.getKeyframe(5).Position))
+        joint.setKeyframe(10, bvhio.Transform(position=(20, 0, 0)), keep=[])
+        self.assertGreater(1e-05, deviationPosition(glm.vec3(10, 0, 0), joint.getKeyframe(5).Position))
+
+        # stored keyframes handed out can be modified later on
+        key = joint.getKeyframe(10)
+        joint.getKeyframe(5)
+        key.Position = (40, 0, 0)
+        self.assertGreater(1e-05, deviationPosition(glm.vec3(20, 0, 0), joint.getKeyframe(5).Position))
+
+    def test_Keyframes_modified(self):
+        root = bvhio.Joint('Root').attach(bvhio.Joint('Child'))
+        root.setKeyframe(0, bvhio.Transform(position=(1, 0, 0)), keep=None)
+        root.setKeyframe(10, bvhio.Transform(position=(1, 0, 0)), keep=None)
+        key = root.getKeyframe(0)
+        root.loadPose(0, recursive=True)
+        root._sampleHierarchy(0)
+
+        # stored keyframes modified in place are used by all sampling paths
+        key.Position = (7, 0, 0)
+        for frame, expected in ((0, 7), (5, 4)):
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), root.loadPose(frame, recursive=True).Position))
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), root.loadPose(frame, recursive=False).Position))
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(expected, 0, 0), glm.vec3(root._sampleHierarchy(frame)[0][0])))
+
+    def test_Keyframes_shared(self):
+        source, target = bvhio.Joint('Source'), bvhio.Joint('Target')
+        for frame in range(3):
+            source.setKeyframe(frame, bvhio.Transform(position=(frame, 0, 0)), keep=None)
+        source._getKeyframeArrays()
+
+        # keyframes given to another joint are still noticed by both joints
+        target.Keyframes = source.Keyframes
+        target._getKeyframeArrays()
+        source.getKeyframe(0).Position = (100, 0, 0)
+        for joint in (source, target):
+            self.assertGreater(1e-05, deviationPosition(glm.vec3(100, 0, 0), glm.vec3(joint._getKeyframeArrays()[2][0])))
+
+        # removing a shared keyframe from one joint does not affect the other one
+        source.removeKeyframe(1)
+        target.getKeyframe(1).Position = (200, 0, 0)
+        self.assertGreater(1e-05, deviationPosition(glm.vec3(200, 0, 0), glm.vec3(target._getKeyframeArrays()[2][1])))
+
+    def test_Keyframes_duplicates(self):
+        joint = bvhio.Joint('Joint')
+        joint.Keyframes = [(0, bvhio.Transform(position=(1, 0, 0))), (5, bvhio.Transform()), (0, bvhio.Transform(position=(2, 0, 0)))]
+
+        # the last keyframe given for a frame id is kept
+        self.assertEqual([frame for frame, key in joint.Keyframes], [0, 5])
+        self.assertGreater(1e-05, deviationPosition(glm.vec3(2, 0, 0), joint.getKeyframe(0).Position))
+        self.assertEqual(len(joint.RestPose.Children), 2)
+
+    def test_interpolation_spacing(self):
+        joint = bvhio.Joint('Joint')
+        for frame in range(0, 40, 10):
+            joint.setKeyframe(frame, bvhio.Transform(position=(frame, 0, 0)), keep=None)
+
+        # the even spacing is broken by an extra keyframe
+        for extra in (None, 15):
+            if extra is not None:
+                joint.setKeyframe(extra, bvhio.Transform(position=(extra, 0, 0)), keep=None)
+            for frame in range(0, 31):
+                self.assertGreater(1e-05, deviationPosition(glm.vec3(frame, 0, 0), joint.getKeyframe(frame).Position))
+
+            # frames between two frame ids are interpolated too
+            for frame in (0.5, 12.5, 29.75):
+                self.assertGreater(1e-05, deviationPosition(glm.vec3(frame, 0, 0), joint.getKeyframe(frame).Position))
+                self.assertGreater(1e-05, deviationPosition(glm.vec3(frame, 0, 0), joint.loadPose(frame).Position))
+
+    def test_loadPose_hierarchy(self):
+        # enough joints to sample the hierarchy at once, if numba is installed
+        root = bvhio.Joint('Root').attach(*[bvhio.readAsHierarchy('bvhio/tests/example.bvh') for _ in range(4)])
+        for joint, index, depth in root.layout():
+            joint.Keyframes = [(frame * 10 + depth, key) for frame, key in joint.Keyframes]
+
+        for frame in range(-3, 20):
+            root.loadPose(frame, recursive=True)
+            pose = [(joint.Position, joint.Rotation, joint.Scale) for joint, _, _ in root.layout()]
+
+            for j, i, d in root.layout():
+                j.loadPose(frame, recursive=False)
+                self.assertGreater(1e-04, deviationPosition(pose[i][0], j.Position))
+                self.assertGreater(1e-05, deviationQuaternion(pose[i][1], j.Rotation))
+                self.assertGreater(1e-05, deviationScale(pose[i][2], j.Scale))
+
+    def test_loadPose_writePose(self):
+        root = bvhio.Joint('Root').attach(*[bvhio.readAsHierarchy('bvhio/tests/example.bvh') for _ in range(4)])
+        start, end = root.getKeyframeRange()
+        for frame in range(start, end + 1):
+            root.loadPose(frame).writePose(frame)
+        arrays = root._getHierarchyArrays()
+        expected = [root.getKeyframe(frame).Position + glm.vec3(0, 1, 0) for frame in range(start, end + 1)]
+
+        # overwritten keyframes update the keyframe arrays in place instead of rebuilding them
+        for frame in range(start, end + 1):
+            root.loadPose(frame)
+            root.Position += glm.vec3(0, 1, 0)
+            root.writePose(frame)
+        self.assertIs(arrays, root._getHierarchyArrays())
+
+        joints = root._flatten()
+        for frame in range(start, end + 1):
+            self.assertGreater(1e-04, deviationPosition(expected[frame - start], root.getKeyframe(frame).Position))
+            positions, rotations, scales = root._sampleHierarchy(frame)
+            for joint, position, rotation, scale in zip(joints, positions, rotations, scales):
+                key = joint.getKeyframe(frame)
+                self.assertGreater(1e-04, deviationPosition(key.Position, glm.vec3(position)))
+                self.assertGreater(1e-05, deviationQuaternion(key.Rotation, glm.quat(rotation)))
+                self.assertGreater(1e-05, deviationScale(key.Scale, glm.vec3(scale)))
+
+    def test_writeRestPose_arrays(self):
+        for keep in (['position', 'rotation', 'scale'], ['position'], ['rotation', 'scale']):
+            root = bvhio.readAsHierarchy('bvhio/tests/example.bvh')
+            root._getHierarchyArrays()
+            for joint, _, _ in root.layout():
+                joint.Position += glm.vec3(1, 2, 3)
+                joint.Rotation = glm.angleAxis(glm.radians(30), glm.vec3(0, 1, 0)) * joint.Rotation
+                joint.Scale *= 2
+
+            # keyframe arrays changed in place are the same as arrays built from the keyframes
+            root.writeRestPose(recursive=True, keep=keep)
+            for joint, _, _ in root.layout():
+                self.assertEqual(joint._KF_synced, joint._KF_version)
+                _, _, positions, rotations, scales = joint._getKeyframeArrays()
+                changed = (positions.copy(), rotations.copy(), scales.copy())
+                joint._KF_synced = -1
+                for built, array in zip(joint._getKeyframeArrays()[2:], changed):
+                    self.assertGreater(1e-04, numpy.abs(built - array).max())